@@ -0,0 +1,38 @@
+"""
+Compare chunk counts and sizes of fixed max_chars chunking and token-budget chunking.
+
+Run from the backend directory, optionally with the source tree to split:
+    python -m benchmarks.bench_chunk_sizes [path]
+"""
+import sys
+from typing import List
+
+import numpy as np
+from llama_index.core import SimpleDirectoryReader
+from llama_index.core.schema import BaseNode
+
+from src.app.custom_splitter import CustomCodeSplitter
+from src.app.file_scanner import scan_code_files
+from src.app.utils import load_encoding
+
+
+def describe(name: str, nodes: List[BaseNode]) -> None:
+    encoding = load_encoding()
+    tokens = np.array([len(encoding.encode(node.text, disallowed_special=())) for node in nodes])
+    print(
+        f"{name:>12} {len(nodes):>8} {tokens.mean():>8.0f} {np.median(tokens):>8.0f} "
+        f"{tokens.max():>8} {tokens.sum():>10}"
+    )
+
+
+def main() -> None:
+    path = sys.argv[1] if len(sys.argv) > 1 else "src"
+    documents = SimpleDirectoryReader(input_files=scan_code_files(path).files).load_data()
+
+    print(f"{'splitter':>12} {'chunks':>8} {'mean tok':>8} {'median':>8} {'max':>8} {'total tok':>10}")
+    describe("max_chars", CustomCodeSplitter(chunk_by_tokens=False).get_nodes_from_documents(documents))
+    describe("tokens", CustomCodeSplitter().get_nodes_from_documents(documents))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Compare MergeSmallChunk against the previous string-concatenation implementation.
+
+Run from the backend directory:
+    python -m benchmarks.bench_merge_small_chunk
+"""
+import copy
+import re
+import time
+from typing import List
+
+from llama_index.core.schema import TextNode
+
+from src.app.custom_transformer import MergeSmallChunk
+
+
+SIZES = [1_000, 2_000, 4_000, 8_000]
+MIN_LENGTH = 10**9  # never reached, so every node is merged into one: the worst case
+
+
+def legacy_merge(nodes: List[TextNode], min_length: int) -> List[TextNode]:
+    merged_nodes = []
+    curr_node = None
+    for node in nodes:
+        if not curr_node:
+            curr_node = node
+        else:
+            curr_node.text = curr_node.text + node.text
+            curr_node.end_char_idx = node.end_char_idx
+
+        if len(re.sub(r"\s", "", curr_node.text)) > min_length and "\n" in curr_node.text:
+            merged_nodes.append(curr_node)
+            curr_node = None
+
+    if curr_node:
+        merged_nodes.append(curr_node)
+
+    return merged_nodes
+
+
+def make_nodes(n: int) -> List[TextNode]:
+    return [
+        TextNode(text=f"x_{i} = {i}\n", start_char_idx=i * 10, end_char_idx=(i + 1) * 10)
+        for i in range(n)
+    ]
+
+
+def timed(fn, nodes: List[TextNode]) -> float:
+    nodes = copy.deepcopy(nodes)
+    start = time.perf_counter()
+    fn(nodes)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    merger = MergeSmallChunk(min_length=MIN_LENGTH)
+    print(f"{'nodes':>8} {'legacy (s)':>12} {'vectorized (s)':>15}")
+    for n in SIZES:
+        nodes = make_nodes(n)
+        legacy = timed(lambda ns: legacy_merge(ns, MIN_LENGTH), nodes)
+        vectorized = timed(merger, nodes)
+        print(f"{n:>8} {legacy:>12.4f} {vectorized:>15.4f}")
+
+
+if __name__ == "__main__":
+    main()
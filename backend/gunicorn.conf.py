@@ -0,0 +1,13 @@
+# Picked up automatically by gunicorn when started from the backend directory.
+# Settings passed on the command line take precedence.
+
+# Import the app once in the master so workers share its memory copy-on-write
+preload_app = True
+
+
+def on_starting(server):
+    # Map local indexes before workers are forked, so every worker shares the same pages
+    from src.app.symbol_index import preload_symbol_indexes
+
+    count = preload_symbol_indexes()
+    server.log.info(f"Preloaded symbol indexes of {count} collections")
@@ -0,0 +1,145 @@
+from __future__ import annotations
+import asyncio
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+
+# Lower values are dispatched first
+INTERACTIVE = 0
+BULK = 1
+
+
+class MicroBatcher:
+    """
+    Coalesce requests from all callers, sync or async, into batches.
+
+    A dispatcher thread waits up to max_wait_ms after the first pending request, or until
+    max_batch_size requests are pending, and hands the batch to batch_fn in a worker
+    thread. Pending requests are taken in priority order, so interactive requests jump
+    ahead of queued bulk work, and a batch never mixes priorities, so a failing bulk
+    request cannot fail an interactive one. batch_fn returns one result per item;
+    returning an Exception instance for an item fails only that item's future.
+
+    If size_fn is given, a batch is also closed before the summed size_fn of its items
+    exceeds max_batch_cost. An item that exceeds it on its own is sent in a batch alone.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch_size: int,
+        max_wait_ms: float = 5,
+        max_concurrency: int = 4,
+        name: str = "batcher",
+        size_fn: Optional[Callable[[Any], int]] = None,
+        max_batch_cost: Optional[int] = None,
+    ) -> None:
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.size_fn = size_fn
+        self.max_batch_cost = max_batch_cost
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrency = max_concurrency
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._pid: Optional[int] = None
+        # (priority, sequence, item, future, cost)
+        self._queue: queue.PriorityQueue[Tuple[int, int, Any, Future, int]]
+        self._executor: ThreadPoolExecutor
+        self._slots: threading.Semaphore
+
+    def _ensure_started(self) -> None:
+        # Threads do not survive fork, so a forked worker starts its own dispatcher
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.PriorityQueue()
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency, thread_name_prefix=self.name
+            )
+            self._slots = threading.Semaphore(self.max_concurrency)
+            threading.Thread(
+                target=self._dispatch_loop, name=f"{self.name}-dispatcher", daemon=True
+            ).start()
+            self._pid = os.getpid()
+
+    def submit(self, item: Any, priority: int = BULK) -> Future:
+        self._ensure_started()
+        future: Future = Future()
+        # Sized in the caller's thread, so the dispatcher never waits on size_fn
+        cost = self.size_fn(item) if self.size_fn is not None else 0
+        self._queue.put((priority, next(self._counter), item, future, cost))
+        return future
+
+    def submit_many(self, items: Sequence[Any], priority: int = BULK) -> List[Future]:
+        return [self.submit(item, priority) for item in items]
+
+    def run(self, items: Sequence[Any], priority: int = BULK) -> List[Any]:
+        """Submit items and block until all of their results are available."""
+        return [future.result() for future in self.submit_many(items, priority)]
+
+    async def arun(self, items: Sequence[Any], priority: int = BULK) -> List[Any]:
+        """Submit items and await all of their results."""
+        futures = self.submit_many(items, priority)
+        return list(await asyncio.gather(*(asyncio.wrap_future(f) for f in futures)))
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            # Reserve a slot first, so that while every slot is in flight requests stay
+            # in the priority queue and the next batch starts with the most urgent ones
+            self._slots.acquire()
+            batch = [self._queue.get()]
+            cost = batch[0][4]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size and not self._over_budget(cost):
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry[0] != batch[0][0] or self._over_budget(cost + entry[4]):
+                    # Requeued with its original position, so it opens the next batch
+                    # unless something more urgent arrives first
+                    self._queue.put(entry)
+                    break
+                batch.append(entry)
+                cost += entry[4]
+            self._executor.submit(self._run_batch, batch)
+
+    def _over_budget(self, cost: int) -> bool:
+        return self.max_batch_cost is not None and cost > self.max_batch_cost
+
+    def _run_batch(self, batch: List[Tuple[int, int, Any, Future, int]]) -> None:
+        try:
+            batch = [entry for entry in batch if entry[3].set_running_or_notify_cancel()]
+            if not batch:
+                return
+            try:
+                results = self.batch_fn([entry[2] for entry in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"{self.name} returned {len(results)} results for {len(batch)} items"
+                    )
+            except Exception as e:
+                for entry in batch:
+                    entry[3].set_exception(e)
+                return
+
+            for entry, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    entry[3].set_exception(result)
+                else:
+                    entry[3].set_result(result)
+        finally:
+            self._slots.release()
@@ -1,21 +1,100 @@
-from typing import Any, List
+from typing import Any, Dict, List, Tuple, Union
 
 from llama_index.embeddings.azure_openai import AzureOpenAIEmbedding
 from llama_index.llms.azure_openai import AzureOpenAI
-from openai import AsyncOpenAI, OpenAI
-from pydantic import Field
+from openai import BadRequestError
+from pydantic import Field, PrivateAttr
+
+from src.app.batching import BULK, INTERACTIVE, MicroBatcher
+from src.app.utils import load_encoding
 
 
 SUMMARY_PROMPT = "Summarize the following code snippet in one or two concise sentences:"
 
+EMBEDDING_MAX_BATCH_SIZE = 2048
+# Azure rejects embeddings requests above ~300k tokens in total, keep a margin
+EMBEDDING_MAX_BATCH_TOKENS = 250_000
+EMBEDDING_MAX_WAIT_MS = 5
+EMBEDDING_MAX_CONCURRENCY = 4
+SUMMARY_MAX_CONCURRENCY = 8
+
 
 class CustomAzureOpenAICodeEmbedding(AzureOpenAIEmbedding):
     llm: AzureOpenAI = Field(..., description="AzureOpenAI LLM instance")
 
+    _embedding_batcher: MicroBatcher = PrivateAttr()
+    _summary_batcher: MicroBatcher = PrivateAttr()
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        # Shared by every caller of this model: concurrent queries and ingestion jobs
+        # are coalesced into as few embeddings requests as possible
+        self._embedding_batcher = MicroBatcher(
+            self._embed_batch,
+            max_batch_size=EMBEDDING_MAX_BATCH_SIZE,
+            max_wait_ms=EMBEDDING_MAX_WAIT_MS,
+            max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+            name="embeddings",
+            size_fn=self._count_tokens,
+            max_batch_cost=EMBEDDING_MAX_BATCH_TOKENS,
+        )
+        # A completion summarizes a single snippet, so summaries are not coalesced, only
+        # dispatched in priority order with bounded concurrency
+        self._summary_batcher = MicroBatcher(
+            self._summarize_batch,
+            max_batch_size=1,
+            max_wait_ms=0,
+            max_concurrency=SUMMARY_MAX_CONCURRENCY,
+            name="summaries",
+        )
+
     @classmethod
     def class_name(cls) -> str:
         return "CustomAzureOpenAICodeEmbedding"
 
+    @staticmethod
+    def _count_tokens(item: Tuple[str, str]) -> int:
+        return len(load_encoding().encode(item[1], disallowed_special=()))
+
+    def _embed_batch(
+        self, items: List[Tuple[str, str]]
+    ) -> List[Union[List[float], Exception]]:
+        """
+        Embed (engine, text) pairs with one embeddings request per engine.
+
+        Runs on a batcher thread for sync and async callers alike, so every request,
+        async ingestion included, goes through the sync client. An input rejected by the
+        API is returned as its exception, failing only its own caller.
+        """
+        client = self._get_client()
+        indices_by_engine: Dict[str, List[int]] = {}
+        for i, (engine, _) in enumerate(items):
+            indices_by_engine.setdefault(engine, []).append(i)
+
+        embeddings: List[Union[List[float], Exception]] = [[] for _ in items]
+        for engine, indices in indices_by_engine.items():
+            try:
+                response = client.embeddings.create(
+                    input=[items[i][1] for i in indices],
+                    model=engine,
+                    **self.additional_kwargs,
+                )
+            except BadRequestError as e:
+                if len(indices) == 1:
+                    embeddings[indices[0]] = e
+                    continue
+                # One invalid input, e.g. over the per-input token limit, rejects the
+                # whole request: embed the inputs one by one so that only it fails
+                for i in indices:
+                    embeddings[i] = self._embed_batch([items[i]])[0]
+                continue
+            for i, item in zip(indices, response.data):
+                embeddings[i] = item.embedding
+        return embeddings
+
+    def _summarize_batch(self, items: List[Tuple[str, int]]) -> List[str]:
+        return [self._summarize_code(code, max_length) for code, max_length in items]
+
     def _summarize_code(self, code: str, max_length: int = 200) -> str:
         """
         Generate a short natural language summary of a given code snippet using AzureOpenAI LLM.
@@ -35,25 +114,11 @@ class CustomAzureOpenAICodeEmbedding(AzureOpenAIEmbedding):
         summary = response.text.strip()
         return summary
 
-    def _get_embedding(
-        self, client: OpenAI, text: str, engine: str, **kwargs: Any
-    ) -> List[float]:
+    def _get_embedding(self, text: str, engine: str) -> List[float]:
         """Get embedding from a description + code chunk."""
-        text = text.replace("\n", " ")
-
-        description = self._summarize_code(text, max_length=200)
-
-        # Concatenate description and code chunk
-        combined = f"{description}\n{text}"
-        return (
-            client.embeddings.create(input=[combined], model=engine, **kwargs)
-            .data[0]
-            .embedding
-        )
+        return self._get_embeddings([text], engine)[0]
 
-    def _get_embeddings(
-        self, client: OpenAI, list_of_text: List[str], engine: str, **kwargs: Any
-    ) -> List[List[float]]:
+    def _get_embeddings(self, list_of_text: List[str], engine: str) -> List[List[float]]:
         """Get embeddings from a list of descriptions + code chunks."""
         assert len(list_of_text) <= 2048, (
             "The batch size should not be larger than 2048."
@@ -61,102 +126,88 @@ class CustomAzureOpenAICodeEmbedding(AzureOpenAIEmbedding):
 
         list_of_text = [text.replace("\n", " ") for text in list_of_text]
 
-        processed_texts = []
-        for text in list_of_text:
-            description = self._summarize_code(text, max_length=200)
-            combined = f"{description}\n{text}"
-            processed_texts.append(combined)
-
-        response = client.embeddings.create(
-            input=processed_texts, model=engine, **kwargs
+        descriptions = self._summary_batcher.run(
+            [(text, 200) for text in list_of_text], priority=BULK
         )
-        return [item.embedding for item in response.data]
+        processed_texts = [
+            f"{description}\n{text}"
+            for description, text in zip(descriptions, list_of_text)
+        ]
 
-    async def _asummarize_code(self, code: str, max_length: int = 200) -> str:
-        """
-        Asynchronously generate a short natural language summary of a given code snippet using AzureOpenAI LLM.
-
-        Args:
-            code (str): The code snippet to be summarized.
-            max_length (int, optional): The maximum characters (approximate) of the summary in characters. Defaults to 200.
-
-        Returns:
-            str: A concise natural language summary of the provided code.
-        """
-        prompt = f"{SUMMARY_PROMPT}\n\n{code}"
-        response = await self.llm.acomplete(
-            prompt=prompt,
-            max_tokens=max_length // 4,  # rough estimate: 4 chars per token
-            temperature=1,
+        return self._embedding_batcher.run(
+            [(engine, text) for text in processed_texts], priority=BULK
         )
-        summary = response.text.strip()
-        return summary
 
-    async def _aget_embedding(
-        self, aclient: AsyncOpenAI, text: str, engine: str, **kwargs: Any
-    ) -> List[float]:
+    async def _aget_embedding(self, text: str, engine: str) -> List[float]:
         """Asynchronously get embedding from a description + code chunk."""
-        text = text.replace("\n", " ")
-
-        description = await self._asummarize_code(text, max_length=200)
-
-        # Concatenate description and code chunk
-        combined = f"{description}\n{text}"
-        response = await aclient.embeddings.create(
-            input=[combined], model=engine, **kwargs
-        )
-        return response.data[0].embedding
+        return (await self._aget_embeddings([text], engine))[0]
 
     async def _aget_embeddings(
-        self, aclient: AsyncOpenAI, list_of_text: List[str], engine: str, **kwargs: Any
+        self, list_of_text: List[str], engine: str
     ) -> List[List[float]]:
-        """Get embeddings from a list of descriptions + code chunks."""
+        """Asynchronously get embeddings from a list of descriptions + code chunks."""
         assert len(list_of_text) <= 2048, (
             "The batch size should not be larger than 2048."
         )
 
         list_of_text = [text.replace("\n", " ") for text in list_of_text]
 
-        processed_texts = []
-        for text in list_of_text:
-            description = await self._asummarize_code(text, max_length=200)
-            combined = f"{description}\n{text}"
-            processed_texts.append(combined)
+        descriptions = await self._summary_batcher.arun(
+            [(text, 200) for text in list_of_text], priority=BULK
+        )
+        processed_texts = [
+            f"{description}\n{text}"
+            for description, text in zip(descriptions, list_of_text)
+        ]
 
-        response = await aclient.embeddings.create(
-            input=processed_texts, model=engine, **kwargs
+        return await self._embedding_batcher.arun(
+            [(engine, text) for text in processed_texts], priority=BULK
         )
-        return [item.embedding for item in response.data]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        """Get query embedding, ahead of queued ingestion work."""
+        retry_decorator = self._create_retry_decorator()
+
+        @retry_decorator
+        def _retryable_get_embedding():
+            return self._embedding_batcher.run(
+                [(self._query_engine, query.replace("\n", " "))], priority=INTERACTIVE
+            )[0]
+
+        return _retryable_get_embedding()
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        """Asynchronously get query embedding, ahead of queued ingestion work."""
+        retry_decorator = self._create_retry_decorator()
+
+        @retry_decorator
+        async def _retryable_aget_embedding():
+            return (
+                await self._embedding_batcher.arun(
+                    [(self._query_engine, query.replace("\n", " "))],
+                    priority=INTERACTIVE,
+                )
+            )[0]
+
+        return await _retryable_aget_embedding()
 
     def _get_text_embedding(self, text: str) -> List[float]:
         """Get text embedding."""
-        client = self._get_client()
         retry_decorator = self._create_retry_decorator()
 
         @retry_decorator
         def _retryable_get_embedding():
-            return self._get_embedding(
-                client,
-                text,
-                engine=self._text_engine,
-                **self.additional_kwargs,
-            )
+            return self._get_embedding(text, engine=self._text_engine)
 
         return _retryable_get_embedding()
 
     async def _aget_text_embedding(self, text: str) -> List[float]:
         """Asynchronously get text embedding."""
-        aclient = self._get_aclient()
         retry_decorator = self._create_retry_decorator()
 
         @retry_decorator
         async def _retryable_aget_embedding():
-            return await self._aget_embedding(
-                aclient,
-                text,
-                engine=self._text_engine,
-                **self.additional_kwargs,
-            )
+            return await self._aget_embedding(text, engine=self._text_engine)
 
         return await _retryable_aget_embedding()
 
@@ -167,32 +218,20 @@ class CustomAzureOpenAICodeEmbedding(AzureOpenAIEmbedding):
         Can be overridden for batch queries.
 
         """
-        client = self._get_client()
         retry_decorator = self._create_retry_decorator()
 
         @retry_decorator
         def _retryable_get_embeddings():
-            return self._get_embeddings(
-                client,
-                texts,
-                engine=self._text_engine,
-                **self.additional_kwargs,
-            )
+            return self._get_embeddings(texts, engine=self._text_engine)
 
         return _retryable_get_embeddings()
 
     async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Asynchronously get text embeddings."""
-        aclient = self._get_aclient()
         retry_decorator = self._create_retry_decorator()
 
         @retry_decorator
         async def _retryable_aget_embeddings():
-            return await self._aget_embeddings(
-                aclient,
-                texts,
-                engine=self._text_engine,
-                **self.additional_kwargs,
-            )
+            return await self._aget_embeddings(texts, engine=self._text_engine)
 
         return await _retryable_aget_embeddings()
@@ -1,9 +1,10 @@
 from __future__ import annotations
 from bisect import bisect_right
 from dataclasses import dataclass
-from typing import Any, Callable, List, Optional, Sequence
+from functools import lru_cache
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
 
-from llama_index.core.bridge.pydantic import Field
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
 from llama_index.core.callbacks.base import CallbackManager
 from llama_index.core.callbacks.schema import CBEventType, EventPayload
 from llama_index.core.node_parser.interface import NodeParser
@@ -13,15 +14,46 @@ from llama_index.core.node_parser.node_utils import (
 )
 from llama_index.core.schema import Document, BaseNode
 from llama_index.core.utils import get_tqdm_iterable
-from tree_sitter import Node
+import numpy as np
+from tree_sitter import Language, Node, Parser
 import tree_sitter_language_pack
 
-from src.app.utils import get_language_from_filename
+from src.app.symbol_index import (
+    DEFINITION_KINDS,
+    SymbolIndex,
+    assign_symbols_to_nodes,
+    extract_symbols,
+)
+from src.app.utils import get_language_from_filename, load_encoding
 
 
 DEFAULT_MAX_CHARS = 500
 DEFAULT_MIN_LINES = 2
 
+# (target, hard max) tokens per chunk
+DEFAULT_TOKEN_BUDGET = (256, 512)
+LANGUAGE_TOKEN_BUDGETS = {
+    # Verbose languages spend more tokens on the same amount of logic
+    "java": (320, 640),
+    "csharp": (320, 640),
+    "kotlin": (320, 640),
+    "scala": (320, 640),
+    "swift": (320, 640),
+    "cpp": (320, 640),
+    "php": (320, 640),
+}
+
+
+@lru_cache(maxsize=None)
+def load_language(language: str) -> Language:
+    """Load a tree-sitter grammar once per process."""
+    return tree_sitter_language_pack.get_language(language)
+
+
+def preload_languages(languages: Iterable[str]) -> None:
+    for language in languages:
+        load_language(language)
+
 
 @dataclass
 class ChunkRange:
@@ -57,24 +89,34 @@ class CodeChunk:
 
 class SourceIndex:
     """
-    Pre-computed start lines in a source code
+    Pre-computed start lines (as UTF-8 byte offsets, like tree-sitter positions) and
+    non-blank line counts in a source code
     """
 
     def __init__(self, source_code: str) -> None:
         self.text = source_code
+        self.num_bytes = len(source_code.encode("utf-8"))
         self.splitted_code = source_code.splitlines()
         self.line_starts: List[int] = []
 
         pos = 0
         for line in source_code.splitlines(keepends=True):
             self.line_starts.append(pos)
-            pos += len(line)
+            pos += len(line.encode("utf-8"))
+
+        # non_blank_prefix[k] is the number of non-whitespace-only lines among the first k
+        non_blank = np.fromiter(
+            (code != "" and not code.isspace() for code in self.splitted_code),
+            dtype=np.int64,
+            count=len(self.splitted_code),
+        )
+        self.non_blank_prefix = np.concatenate(([0], np.cumsum(non_blank)))
 
     def line_of(self, char_idx: int) -> int:
         """
-        Return ***1-based*** line number given a char index.
+        Return ***1-based*** line number given a byte index.
         """
-        if char_idx < 0 or char_idx > len(self.text):
+        if char_idx < 0 or char_idx > self.num_bytes:
             raise ValueError("character index out of range")
 
         return bisect_right(self.line_starts, char_idx)
@@ -84,9 +126,39 @@ class SourceIndex:
         Return number of non-whitespace-only lines in a ChunkRange.
         """
         line_start = self.line_of(chunk_range.start_char_idx)
-        line_end = self.line_of(chunk_range.end_char_idx)
-        chunk_code = self.splitted_code[(line_start - 1) : (line_end - 1)]
-        return len([code for code in chunk_code if code != "" and not code.isspace()])
+        line_end = max(self.line_of(chunk_range.end_char_idx), line_start)
+        return int(
+            self.non_blank_prefix[line_end - 1] - self.non_blank_prefix[line_start - 1]
+        )
+
+
+class TokenIndex:
+    """
+    Pre-computed token start bytes in a source code
+    """
+
+    def __init__(self, text_bytes: bytes) -> None:
+        encoding = load_encoding()
+        tokens = encoding.encode(
+            text_bytes.decode("utf-8", errors="replace"), disallowed_special=()
+        )
+        lengths = np.fromiter(
+            map(len, encoding.decode_tokens_bytes(tokens)),
+            dtype=np.int64,
+            count=len(tokens),
+        )
+        self.token_starts = np.cumsum(lengths) - lengths
+
+    def count(self, start_byte: int, end_byte: int) -> int:
+        """
+        Return number of tokens starting in [start_byte, end_byte).
+        """
+        if end_byte <= start_byte:
+            return 0
+        return int(
+            np.searchsorted(self.token_starts, end_byte)
+            - np.searchsorted(self.token_starts, start_byte)
+        )
 
 
 class CustomCodeSplitter(NodeParser):
@@ -104,11 +176,35 @@ class CustomCodeSplitter(NodeParser):
         description="Minimum number of lines per chunk.",
         gt=0,
     )
+    chunk_by_tokens: bool = Field(
+        default=True,
+        description="Size chunks by tokens instead of max_chars.",
+    )
+    target_tokens: Optional[int] = Field(
+        default=None,
+        description="Token count chunks are packed up to. Defaults to the language budget.",
+        gt=0,
+    )
+    max_tokens: Optional[int] = Field(
+        default=None,
+        description="Hard maximum of tokens per chunk. Defaults to the language budget.",
+        gt=0,
+    )
+    align_to_definitions: bool = Field(
+        default=True,
+        description="Keep definitions up to max_tokens whole instead of splitting them at target_tokens.",
+    )
+
+    _symbol_index: SymbolIndex = PrivateAttr(default_factory=SymbolIndex)
 
     def __init__(
         self,
         max_chars: int = DEFAULT_MAX_CHARS,
         min_lines: int = DEFAULT_MIN_LINES,
+        chunk_by_tokens: bool = True,
+        target_tokens: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        align_to_definitions: bool = True,
         callback_manager: Optional[CallbackManager] = None,
         include_metadata: bool = True,
         include_prev_next_rel: bool = True,
@@ -122,6 +218,10 @@ class CustomCodeSplitter(NodeParser):
         super().__init__(
             max_chars=max_chars,
             min_lines=min_lines,
+            chunk_by_tokens=chunk_by_tokens,
+            target_tokens=target_tokens,
+            max_tokens=max_tokens,
+            align_to_definitions=align_to_definitions,
             callback_manager=callback_manager,
             include_metadata=include_metadata,
             include_prev_next_rel=include_prev_next_rel,
@@ -132,9 +232,14 @@ class CustomCodeSplitter(NodeParser):
     def class_name(cls) -> str:
         return "CustomCodeSplitter"
 
+    @property
+    def symbol_index(self) -> SymbolIndex:
+        """Definitions collected from every file parsed by this splitter."""
+        return self._symbol_index
+
     def _get_parser(self, language: str):
         try:
-            parser = tree_sitter_language_pack.get_parser(language)
+            parser = Parser(load_language(language))
             return parser
         except ImportError:
             raise ImportError(
@@ -156,6 +261,26 @@ class CustomCodeSplitter(NodeParser):
                 curr.end_char_idx = next.start_char_idx
             next.start_char_idx = end_byte
 
+    def _token_budget(self, language: Optional[str]) -> Tuple[int, int]:
+        target, hard_max = LANGUAGE_TOKEN_BUDGETS.get(language, DEFAULT_TOKEN_BUDGET)
+        target = self.target_tokens or target
+        hard_max = self.max_tokens or hard_max
+        return target, max(target, hard_max)
+
+    def _pack_chunks(
+        self, chunks: List[ChunkRange], size: Callable[[int, int], int], target: int
+    ) -> List[ChunkRange]:
+        """Greedily join neighbouring chunks while the result stays within target."""
+        new_chunks: List[ChunkRange] = []
+        for chunk in chunks:
+            if new_chunks:
+                packed = new_chunks[-1] + chunk
+                if size(packed.start_char_idx, packed.end_char_idx) <= target:
+                    new_chunks[-1] = packed
+                    continue
+            new_chunks.append(chunk)
+        return new_chunks
+
     def _merge_chunks(
         self, chunks: List[ChunkRange], source_index: SourceIndex
     ) -> List[ChunkRange]:
@@ -170,38 +295,66 @@ class CustomCodeSplitter(NodeParser):
             new_chunks.append(current_chunk)
         return new_chunks
 
-    def get_chunks(self, root_node: Any, source_index: SourceIndex) -> List[CodeChunk]:
+    def get_chunks(
+        self,
+        root_node: Any,
+        source_index: SourceIndex,
+        token_index: Optional[TokenIndex] = None,
+        language: Optional[str] = None,
+    ) -> List[CodeChunk]:
         """
-        Recursively chunk a node into smaller pieces based on character limits.
+        Recursively chunk a node into smaller pieces based on token or character limits.
+
+        With a token index, children are packed up to the target token count of the
+        language, and definitions are only split when they exceed the hard maximum (if
+        align_to_definitions is set). Without one, max_chars is used for both.
 
         Args:
-            node (Any): The AST node to chunk.
-            text_bytes (bytes): The original source code text as bytes.
-            last_end (int, optional): The ending position of the last processed chunk. Defaults to 0.
+            root_node (Any): The AST node to chunk.
+            source_index (SourceIndex): Line index of the source code.
+            token_index (TokenIndex, optional): Token index of the source code. Defaults to None.
+            language (str, optional): Language of the source code. Defaults to None.
 
         Returns:
-            List[str]: A list of code chunks that respect the max_chars limit.
+            List[CodeChunk]: A list of code chunks that respect the size limits.
 
         """
+        if token_index is not None:
+            size = token_index.count
+            target, hard_max = self._token_budget(language)
+        else:
+
+            def size(start: int, end: int) -> int:
+                return max(end - start, 0)
+
+            target = hard_max = self.max_chars
+
+        def split_limit(child: Node) -> int:
+            if self.align_to_definitions and child.type in DEFINITION_KINDS:
+                return hard_max
+            return target
 
         def chunk_node(node: Node) -> List[ChunkRange]:
             new_chunks: List[ChunkRange] = []
             current_chunk: ChunkRange = ChunkRange(node.start_byte, node.start_byte)
             node_children = node.children
             for child in node_children:
-                if child.end_byte - child.start_byte > self.max_chars:
+                child_size = size(child.start_byte, child.end_byte)
+                if child_size > split_limit(child):
                     # Child is too big, recursively chunk the child
                     if len(current_chunk) > 0:
                         new_chunks.append(current_chunk)
                     current_chunk = ChunkRange(-1, -1)
                     new_chunks.extend(chunk_node(child))
                 elif (
-                    len(current_chunk) + child.end_byte - child.start_byte
-                    > self.max_chars
+                    size(current_chunk.start_char_idx, current_chunk.end_char_idx)
+                    + child_size
+                    > target
                 ):
                     # Child would make the current chunk too big, so start a new chunk
-                    new_chunks.append(current_chunk)
-                    current_chunk = ChunkRange(-1, -1)
+                    if len(current_chunk) > 0:
+                        new_chunks.append(current_chunk)
+                    current_chunk = ChunkRange(child.start_byte, child.end_byte)
                 else:
                     if current_chunk.start_char_idx == -1:
                         current_chunk = ChunkRange(child.start_byte, child.end_byte)
@@ -213,6 +366,8 @@ class CustomCodeSplitter(NodeParser):
 
         chunks = chunk_node(root_node)
         self._connect_chunks(chunks, root_node.end_byte)
+        if token_index is not None:
+            chunks = self._pack_chunks(chunks, size, target)
         merged_chunks: List[ChunkRange] = self._merge_chunks(chunks, source_index)
         code_chunks = [
             CodeChunk(
@@ -225,6 +380,28 @@ class CustomCodeSplitter(NodeParser):
 
         return code_chunks
 
+    def _attach_symbols(self, node: BaseNode, nodes: List[BaseNode], root_node: Node) -> None:
+        """
+        Record the definitions of a file in the symbol index and tag each chunk with the
+        names of the definitions that start inside it.
+        """
+        file_path = node.metadata.get("file_path", node.metadata["file_name"])
+        symbols = extract_symbols(root_node, file_path)
+        assign_symbols_to_nodes(symbols, nodes, file_path=file_path)
+        for symbol in symbols:
+            self._symbol_index.add(symbol)
+
+        for chunk_node in nodes:
+            # Keep symbol names out of the embedded and LLM-visible text
+            chunk_node.excluded_embed_metadata_keys = [
+                *chunk_node.excluded_embed_metadata_keys,
+                "symbols",
+            ]
+            chunk_node.excluded_llm_metadata_keys = [
+                *chunk_node.excluded_llm_metadata_keys,
+                "symbols",
+            ]
+
     def _parse_nodes(
         self, nodes: Sequence[BaseNode], show_progress: bool = False, **kwargs: Any
     ) -> List[BaseNode]:
@@ -244,13 +421,17 @@ class CustomCodeSplitter(NodeParser):
                 text_bytes = bytes(code, "utf-8")
                 tree = self._get_parser(language).parse(text_bytes)
                 source_index = SourceIndex(code)
+                token_index = TokenIndex(text_bytes) if self.chunk_by_tokens else None
 
                 if (
                     not tree.root_node.children
                     or tree.root_node.children[0].type != "ERROR"
                 ):
                     chunks = [
-                        chunk for chunk in self.get_chunks(tree.root_node, source_index)
+                        chunk
+                        for chunk in self.get_chunks(
+                            tree.root_node, source_index, token_index, language
+                        )
                     ]
                     event.on_end(
                         payload={EventPayload.CHUNKS: chunks},
@@ -266,6 +447,7 @@ class CustomCodeSplitter(NodeParser):
                         nodes[i].metadata["line_start"] = chunks[i].line_start
                         nodes[i].metadata["line_end"] = chunks[i].line_end
 
+                    self._attach_symbols(node, nodes, tree.root_node)
                     all_nodes.extend(nodes)
                 else:
                     raise ValueError(f"Could not parse code with language {language}.")
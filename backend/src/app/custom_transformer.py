@@ -1,38 +1,86 @@
 import re
-from llama_index.core.schema import TransformComponent
+from itertools import groupby
+from typing import List, Sequence
+
+import numpy as np
+from llama_index.core.schema import BaseNode, TransformComponent
 from pydantic import Field
 
 
+WHITESPACE_PATTERN = re.compile(r"\s")
+
+
 class MergeSmallChunk(TransformComponent):
     min_length: int = Field(
         ..., description="Minimum non-whitespace length for a chunk"
     )
+    separator: str = Field(
+        default="", description="String inserted between the texts of merged chunks"
+    )
 
-    def __init__(self, min_length: int):
-        super().__init__(min_length=min_length)
+    def __init__(self, min_length: int, separator: str = ""):
+        super().__init__(min_length=min_length, separator=separator)
         self.min_length = min_length
+        self.separator = separator
 
     def non_whitespace_len(self, s: str) -> int:
-        return len(re.sub(r"\s", "", s))
+        return len(WHITESPACE_PATTERN.sub("", s))
+
+    def _merge_ranges(self, texts: List[str]) -> List[range]:
+        """
+        Split a run of chunks into consecutive ranges, each closed as soon as its joined
+        text has more than min_length non-whitespace characters and contains a newline.
 
-    def __call__(self, nodes, **kwargs):
+        Both conditions are monotonic in the range end, so the end of every range is the
+        later of the first index reaching the length (binary search over prefix sums) and
+        the first index containing a newline.
+        """
+        n = len(texts)
+        lengths = np.fromiter(
+            (self.non_whitespace_len(text) for text in texts), dtype=np.int64, count=n
+        )
+        cum_lengths = np.concatenate(([0], np.cumsum(lengths)))
+
+        has_newline = np.fromiter(("\n" in text for text in texts), dtype=bool, count=n)
+        newline_idx = np.where(has_newline, np.arange(n), n)
+        next_newline = np.minimum.accumulate(newline_idx[::-1])[::-1]
+        separator_has_newline = "\n" in self.separator
+
+        ranges: List[range] = []
+        start = 0
+        while start < n:
+            length_end = int(
+                np.searchsorted(
+                    cum_lengths, cum_lengths[start] + self.min_length, side="right"
+                )
+            ) - 1
+            newline_end = int(next_newline[start])
+            if separator_has_newline:
+                newline_end = min(newline_end, start + 1)
+            end = max(length_end, newline_end, start)
+            if end >= n:
+                end = n - 1
+            ranges.append(range(start, end + 1))
+            start = end + 1
+        return ranges
+
+    def _merge_run(self, nodes: List[BaseNode]) -> List[BaseNode]:
+        texts = [node.text for node in nodes]
         merged_nodes = []
-        curr_node = None
-        for node in nodes:
-            if not curr_node:
-                curr_node = node
-            else:
-                curr_node.text = curr_node.text + node.text
-                curr_node.end_char_idx = node.end_char_idx
-
-            if (
-                self.non_whitespace_len(curr_node.text) > self.min_length
-                and "\n" in curr_node.text
-            ):
-                merged_nodes.append(curr_node)
-                curr_node = None
-
-        if curr_node:
+        for merge_range in self._merge_ranges(texts):
+            curr_node = nodes[merge_range.start]
+            if len(merge_range) > 1:
+                last_node = nodes[merge_range.stop - 1]
+                curr_node.text = self.separator.join(texts[merge_range.start : merge_range.stop])
+                curr_node.end_char_idx = last_node.end_char_idx
+                if "line_end" in curr_node.metadata and "line_end" in last_node.metadata:
+                    curr_node.metadata["line_end"] = last_node.metadata["line_end"]
             merged_nodes.append(curr_node)
+        return merged_nodes
 
+    def __call__(self, nodes: Sequence[BaseNode], **kwargs) -> List[BaseNode]:
+        # Chunks are only merged with neighbours from the same source document
+        merged_nodes = []
+        for _, run in groupby(nodes, key=lambda node: node.ref_doc_id):
+            merged_nodes.extend(self._merge_run(list(run)))
         return merged_nodes
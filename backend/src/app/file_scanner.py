@@ -0,0 +1,270 @@
+from __future__ import annotations
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.app.utils import get_language_from_filename
+
+
+DEFAULT_MAX_FILE_BYTES = 1_000_000
+
+IGNORED_DIRS = {
+    ".git",
+    ".hg",
+    ".svn",
+    "node_modules",
+    "bower_components",
+    "__pycache__",
+    ".venv",
+    "venv",
+    ".tox",
+    ".mypy_cache",
+    ".pytest_cache",
+    ".idea",
+    ".vscode",
+    ".next",
+    ".nuxt",
+    "dist",
+    "build",
+    "target",
+    "obj",
+    "vendor",
+    "coverage",
+}
+
+GENERATED_FILE_PATTERN = re.compile(
+    r"(\.min\.[a-z]+$)"
+    r"|([._-]generated\.[a-z]+$)"
+    r"|(_pb2(_grpc)?\.py$)"
+    r"|(\.pb(\.gw)?\.go$)"
+    r"|(_string\.go$)"
+    r"|(\.g\.(cs|dart)$)"
+    r"|(\.designer\.cs$)"
+    r"|(\.bundle\.js$)",
+    re.IGNORECASE,
+)
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """Translate a single gitignore glob into a regex fragment."""
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex += "/.*"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                body = pattern[i + 1 : end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                regex += f"[{body}]"
+                i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex
+
+
+@dataclass
+class IgnoreRule:
+    regex: re.Pattern
+    negate: bool
+    dir_only: bool
+
+
+class GitIgnore:
+    """
+    Rules of a single .gitignore file, matched against paths relative to its directory.
+    """
+
+    def __init__(self, base_dir: str, lines: List[str]) -> None:
+        self.base_dir = base_dir
+        self.rules: List[IgnoreRule] = []
+        for line in lines:
+            rule = self._parse_line(line)
+            if rule is not None:
+                self.rules.append(rule)
+
+    @classmethod
+    def from_dir(cls, base_dir: str) -> Optional[GitIgnore]:
+        path = os.path.join(base_dir, ".gitignore")
+        if not os.path.isfile(path):
+            return None
+        with open(path, encoding="utf-8", errors="replace") as f:
+            gitignore = cls(base_dir, f.read().splitlines())
+        return gitignore if gitignore.rules else None
+
+    def _parse_line(self, line: str) -> Optional[IgnoreRule]:
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            return None
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            return None
+        # A pattern with a slash anywhere but the end is relative to the .gitignore directory
+        anchored = "/" in line
+        line = line.lstrip("/")
+        prefix = "" if anchored else "(?:.*/)?"
+        regex = re.compile(f"^{prefix}{_glob_to_regex(line)}$")
+        return IgnoreRule(regex=regex, negate=negate, dir_only=dir_only)
+
+    def match(self, path: str, is_dir: bool) -> Optional[bool]:
+        """
+        Return True if ignored, False if explicitly re-included, None if no rule applies.
+        """
+        rel_path = os.path.relpath(path, self.base_dir).replace(os.sep, "/")
+        result = None
+        for rule in self.rules:
+            if rule.dir_only and not is_dir:
+                continue
+            if rule.regex.match(rel_path):
+                result = not rule.negate
+        return result
+
+
+@dataclass
+class ScanResult:
+    files: List[str] = field(default_factory=list)
+    skipped: Counter = field(default_factory=Counter)
+    bytes_selected: int = 0
+    bytes_skipped: int = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "files": len(self.files),
+            "bytes_selected": self.bytes_selected,
+            "bytes_skipped": self.bytes_skipped,
+            "skipped": dict(self.skipped),
+        }
+
+
+def _is_ignored(
+    path: str, is_dir: bool, gitignores: List[GitIgnore]
+) -> bool:
+    ignored = False
+    for gitignore in gitignores:
+        result = gitignore.match(path, is_dir)
+        if result is not None:
+            ignored = result
+    return ignored
+
+
+def scan_code_files(
+    root: str, max_file_bytes: int = DEFAULT_MAX_FILE_BYTES
+) -> ScanResult:
+    """
+    Walk a source tree and select the files worth indexing, without opening any of them.
+
+    Hidden entries, directories in IGNORED_DIRS and paths matched by .gitignore files
+    are pruned, then files are rejected by extension (EXT_TO_LANG), generated-file naming
+    conventions and size. The reason for every rejected file is counted in
+    ScanResult.skipped and its size in ScanResult.bytes_skipped; files below pruned
+    directories are not visited, so they are not counted.
+
+    Args:
+        root (str): Directory to scan.
+        max_file_bytes (int, optional): Files larger than this are skipped. Defaults to 1MB.
+
+    Returns:
+        ScanResult: Selected file paths in a stable order, plus skip statistics.
+
+    Raises:
+        ValueError: If root is not a directory.
+    """
+    if not os.path.isdir(root):
+        raise ValueError(f"Directory {root} does not exist.")
+
+    result = ScanResult()
+    stack: List[Tuple[str, List[GitIgnore]]] = [(root, [])]
+
+    while stack:
+        dir_path, parent_gitignores = stack.pop()
+        gitignores = parent_gitignores
+        gitignore = GitIgnore.from_dir(dir_path)
+        if gitignore is not None:
+            gitignores = [*parent_gitignores, gitignore]
+
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            # An unreadable root fails the job, an unreadable subdirectory is skipped
+            if dir_path == root:
+                raise
+            result.skipped["unreadable"] += 1
+            continue
+
+        sub_dirs: List[str] = []
+        for entry in entries:
+            if entry.is_symlink():
+                result.skipped["symlink"] += 1
+                continue
+
+            if entry.is_dir():
+                # Hidden directories are skipped, as SimpleDirectoryReader did
+                if entry.name.startswith("."):
+                    result.skipped["hidden"] += 1
+                elif entry.name in IGNORED_DIRS:
+                    result.skipped["ignored_dir"] += 1
+                elif _is_ignored(entry.path, True, gitignores):
+                    result.skipped["gitignore"] += 1
+                else:
+                    sub_dirs.append(entry.path)
+                continue
+
+            if not entry.is_file():
+                continue
+
+            size = entry.stat().st_size
+            reason = None
+            if entry.name.startswith("."):
+                reason = "hidden"
+            elif get_language_from_filename(entry.name) is None:
+                reason = "unsupported_extension"
+            elif _is_ignored(entry.path, False, gitignores):
+                reason = "gitignore"
+            elif GENERATED_FILE_PATTERN.search(entry.name):
+                reason = "generated"
+            elif size == 0:
+                reason = "empty"
+            elif size > max_file_bytes:
+                reason = "too_large"
+
+            if reason is None:
+                result.files.append(entry.path)
+                result.bytes_selected += size
+            else:
+                result.skipped[reason] += 1
+                result.bytes_skipped += size
+
+        # Reversed so that directories are visited in sorted order
+        stack.extend((sub_dir, gitignores) for sub_dir in reversed(sub_dirs))
+
+    return result
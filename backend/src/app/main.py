@@ -1,9 +1,11 @@
 from contextlib import asynccontextmanager
 import os
+import time
 from dotenv import load_dotenv
 import uvicorn
 from src.app.models import SearchChunkResponse, SearchQuery
 from src.app.setup import setup_llama_index
+from src.app.warmup import WarmupConfig, WarmupReport, run_warmup
 from src.app.store import (
     create_collections_impl,
     delete_collection_impl,
@@ -13,6 +15,7 @@ from src.app.store import (
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 from fastapi import Body, status
 from typing import List
@@ -22,7 +25,10 @@ import uuid
 
 job_queue = None
 job_status = {}
+job_stats = {}
 worker_task = None
+warmup_task = None
+warmup_report = None
 
 
 async def async_worker():
@@ -33,21 +39,44 @@ async def async_worker():
         job_id, collection_name, path = job
         job_status[job_id] = "running"
         try:
-            num_docs = await init_collection_impl(collection_name, path)
-            job_status[job_id] = f"done ({num_docs} chunks)"
+            stats = await init_collection_impl(collection_name, path)
+            job_stats[job_id] = stats
+            job_status[job_id] = f"done ({stats['chunks']} chunks)"
         except Exception as e:
             job_status[job_id] = f"error: {e}"
         finally:
             job_queue.task_done()
 
 
+async def warmup(setup_seconds: float):
+    global warmup_report
+    config = WarmupConfig.from_env()
+    while True:
+        report: WarmupReport = await asyncio.to_thread(run_warmup, config)
+        if warmup_report is not None:
+            report.add_previous(warmup_report)
+        report.timings["setup"] = round(setup_seconds, 3)
+        warmup_report = report
+        print(
+            f"Warmup finished: attempts={report.attempts} "
+            f"timings={report.timings} errors={report.errors}"
+        )
+        if report.ready:
+            break
+        # Stay unready, and retry until the dependencies that failed come up
+        await asyncio.sleep(config.retry_seconds)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global job_queue, worker_task
+    global job_queue, worker_task, warmup_task
     job_queue = asyncio.Queue()
+    start = time.perf_counter()
     setup_llama_index()
+    warmup_task = asyncio.create_task(warmup(time.perf_counter() - start))
     worker_task = asyncio.create_task(async_worker())
     yield
+    warmup_task.cancel()
     await job_queue.put(None)  # Signal to exit worker
     await worker_task
 
@@ -71,6 +100,31 @@ async def root():
     return {"message": "Hello World"}
 
 
+@app.get("/ready")
+async def ready():
+    if warmup_report is None:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "warming up"},
+        )
+    if not warmup_report.ready:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={
+                "status": "unavailable",
+                "attempts": warmup_report.attempts,
+                "timings": warmup_report.timings,
+                "errors": warmup_report.errors,
+            },
+        )
+    return {
+        "status": "ready",
+        "attempts": warmup_report.attempts,
+        "timings": warmup_report.timings,
+        "errors": warmup_report.errors,
+    }
+
+
 # @app.post("/collections/{collection_name}")
 # async def create_collection(collection_name: str):
 #     try:
@@ -103,7 +157,10 @@ async def root():
 
 # @app.get("/collections/init/status/{job_id}")
 # def get_status(job_id: str):
-#     return {"status": job_status.get(job_id, "unknown")}
+#     return {
+#         "status": job_status.get(job_id, "unknown"),
+#         "stats": job_stats.get(job_id),
+#     }
 
 
 @app.post(
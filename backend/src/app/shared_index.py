@@ -0,0 +1,176 @@
+"""
+Versioned, memory-mapped local index artifacts shared by all worker processes.
+
+Each artifact of a collection lives in its own directory:
+
+    {LOCAL_INDEX_DIR}/{collection}/{artifact}/
+        CURRENT        name of the version directory readers should use
+        v<ns>/         one immutable directory per published version
+
+Artifacts are written once into a fresh version directory and published by atomically
+replacing CURRENT. Readers map the files read-only, so every worker (and a gunicorn
+master that loaded them before forking) shares the same page-cache pages instead of
+holding its own copy, and picks up a new version the next time it checks CURRENT.
+"""
+from __future__ import annotations
+import fcntl
+import mmap
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple, TypeVar
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+load_dotenv()
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", ".local_index")
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "LOCK"
+# Versions kept on disk, so that a reader that just resolved CURRENT can still open it
+KEEP_VERSIONS = 2
+
+T = TypeVar("T")
+
+# (collection, artifact) -> (identity of the CURRENT file, loaded artifact)
+_loaded: Dict[Tuple[str, str], Tuple[Tuple[int, int], object]] = {}
+
+
+def artifact_dir(collection_name: str, artifact: str) -> str:
+    return os.path.join(LOCAL_INDEX_DIR, collection_name, artifact)
+
+
+@contextmanager
+def artifact_lock(collection_name: str, artifact: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock on an artifact across processes, for read-modify-publish
+    updates. Not reentrant: publish_version does not take it itself.
+    """
+    base_dir = artifact_dir(collection_name, artifact)
+    os.makedirs(base_dir, exist_ok=True)
+    with open(os.path.join(base_dir, LOCK_FILE), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def save_array(version_dir: str, name: str, array: np.ndarray) -> None:
+    np.save(os.path.join(version_dir, f"{name}.npy"), array, allow_pickle=False)
+
+
+def load_array(version_dir: str, name: str) -> np.ndarray:
+    return np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode="r")
+
+
+def save_blob(version_dir: str, name: str, data: bytes) -> None:
+    with open(os.path.join(version_dir, f"{name}.bin"), "wb") as f:
+        f.write(data)
+
+
+def load_blob(version_dir: str, name: str) -> mmap.mmap | bytes:
+    with open(os.path.join(version_dir, f"{name}.bin"), "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _prune_versions(base_dir: str) -> None:
+    versions = sorted(
+        (name for name in os.listdir(base_dir) if name.startswith("v")),
+        key=lambda name: int(name[1:]),
+    )
+    for version in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(base_dir, version), ignore_errors=True)
+
+
+def publish_version(
+    collection_name: str, artifact: str, write_fn: Callable[[str], None]
+) -> str:
+    """
+    Write a new version of an artifact with write_fn(version_dir) and make it current.
+
+    Returns:
+        str: The directory of the published version.
+    """
+    base_dir = artifact_dir(collection_name, artifact)
+    os.makedirs(base_dir, exist_ok=True)
+
+    version = f"v{time.time_ns()}"
+    version_dir = os.path.join(base_dir, version)
+    os.makedirs(version_dir)
+    write_fn(version_dir)
+
+    tmp_path = os.path.join(base_dir, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(base_dir, CURRENT_FILE))
+
+    _prune_versions(base_dir)
+    return version_dir
+
+
+def get_current(
+    collection_name: str, artifact: str, load_fn: Callable[[str], T]
+) -> Optional[T]:
+    """
+    Return the current version of an artifact, loading it with load_fn(version_dir) the
+    first time and again whenever another process has published a new version.
+
+    The check costs a single stat() call of the CURRENT file.
+    """
+    try:
+        return _load_current(collection_name, artifact, load_fn)
+    except FileNotFoundError:
+        # Two quick publishes pruned the version named by CURRENT before it was loaded,
+        # CURRENT now names a newer one
+        return _load_current(collection_name, artifact, load_fn)
+
+
+def _load_current(
+    collection_name: str, artifact: str, load_fn: Callable[[str], T]
+) -> Optional[T]:
+    base_dir = artifact_dir(collection_name, artifact)
+    try:
+        stat = os.stat(os.path.join(base_dir, CURRENT_FILE))
+    except FileNotFoundError:
+        _loaded.pop((collection_name, artifact), None)
+        return None
+
+    identity = (stat.st_ino, stat.st_mtime_ns)
+    cached = _loaded.get((collection_name, artifact))
+    if cached is not None and cached[0] == identity:
+        return cached[1]
+
+    with open(os.path.join(base_dir, CURRENT_FILE), encoding="utf-8") as f:
+        version = f.read().strip()
+    loaded = load_fn(os.path.join(base_dir, version))
+    _loaded[(collection_name, artifact)] = (identity, loaded)
+    return loaded
+
+
+def drop_artifacts(collection_name: str) -> None:
+    for key in [key for key in _loaded if key[0] == collection_name]:
+        del _loaded[key]
+    shutil.rmtree(os.path.join(LOCAL_INDEX_DIR, collection_name), ignore_errors=True)
+
+
+def preload(artifact: str, load_fn: Callable[[str], object]) -> int:
+    """
+    Map the current version of an artifact for every collection on disk.
+
+    Meant to run in the gunicorn master before workers are forked.
+
+    Returns:
+        int: Number of collections loaded.
+    """
+    if not os.path.isdir(LOCAL_INDEX_DIR):
+        return 0
+    count = 0
+    for collection_name in sorted(os.listdir(LOCAL_INDEX_DIR)):
+        if get_current(collection_name, artifact, load_fn) is not None:
+            count += 1
+    return count
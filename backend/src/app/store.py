@@ -2,30 +2,51 @@ import os
 import re
 from dotenv import load_dotenv
 from pymilvus import connections, utility
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from llama_index.vector_stores.milvus import MilvusVectorStore
 from llama_index.core import Settings
-from llama_index.core import SimpleDirectoryReader, VectorStoreIndex, StorageContext
+from llama_index.core import VectorStoreIndex, StorageContext
 from llama_index.core.postprocessor import LLMRerank
+from llama_index.core.schema import NodeWithScore
 from src.app.models import SearchChunkResponse
-from src.app.custom_splitter import CustomCodeSplitter
-from llama_index.core.ingestion import IngestionPipeline
+from src.app.utils import load_encoding
+from src.app.symbol_index import (
+    Symbol,
+    assign_symbols_to_nodes,
+    drop_symbol_index,
+    get_symbol_index,
+    merge_symbol_index,
+    parse_where_defined,
+)
 
 
 load_dotenv()
 MILVUS_URI = os.getenv("MILVUS_URI")
 MILVUS_TOKEN = os.getenv("MILVUS_TOKEN")
+MIN_CHUNK_LENGTH = 50
+# Twice the largest hard max of the splitter, so that a collapsed result stays a small
+# share of the rerank prompt
+MAX_COLLAPSED_TOKENS = 1280
+WARMUP_QUERY = "warmup"
+
+_vector_stores: Dict[str, MilvusVectorStore] = {}
 
 
 def _get_or_create_store(collection_name: str) -> MilvusVectorStore:
-    return MilvusVectorStore(
-        uri=MILVUS_URI, token=MILVUS_TOKEN,
-        collection_name=collection_name,
-        enable_dense=True,
-        dim=1536,
-        enable_sparse=True,
-        overwrite=False,
-    )
+    if collection_name not in _vector_stores:
+        _vector_stores[collection_name] = MilvusVectorStore(
+            uri=MILVUS_URI, token=MILVUS_TOKEN,
+            collection_name=collection_name,
+            enable_dense=True,
+            dim=1536,
+            enable_sparse=True,
+            overwrite=False,
+        )
+    return _vector_stores[collection_name]
+
+
+def connect_milvus():
+    connections.connect(uri=MILVUS_URI, token=MILVUS_TOKEN)
 
 
 def create_collections_impl(collection_name: str):
@@ -44,30 +65,76 @@ def delete_collection_impl(collection_name: str):
         raise ValueError(f"Collection '{collection_name}' does not exist.")
 
     utility.drop_collection(collection_name)
+    _vector_stores.pop(collection_name, None)
+    drop_symbol_index(collection_name)
 
 
 async def init_collection_impl(collection_name: str, path: str):
+    # Ingestion-only dependencies (tree-sitter, readers) are imported on first use to
+    # keep worker boot fast for search traffic
+    from llama_index.core import SimpleDirectoryReader
+    from llama_index.core.ingestion import IngestionPipeline
+    from src.app.custom_splitter import CustomCodeSplitter
+    from src.app.custom_transformer import MergeSmallChunk
+    from src.app.file_scanner import scan_code_files
+
     connections.connect(uri=MILVUS_URI, token=MILVUS_TOKEN)
 
     if not utility.has_collection(collection_name):
         raise ValueError(f"Collection '{collection_name}' does not exist.")
 
     # TODO: Sanitize input
-    documents = SimpleDirectoryReader(input_dir=path, recursive=True).load_data()
+    scan_result = scan_code_files(path)
+    stats = scan_result.stats()
+    if not scan_result.files:
+        stats["chunks"] = 0
+        return stats
+
+    documents = SimpleDirectoryReader(input_files=scan_result.files).load_data()
 
     vector_store = _get_or_create_store(collection_name)
 
+    splitter = CustomCodeSplitter()
     pipeline = IngestionPipeline(
-        transformations=[CustomCodeSplitter(), Settings.embed_model],
-        vector_store=vector_store,
+        transformations=[
+            splitter,
+            MergeSmallChunk(min_length=MIN_CHUNK_LENGTH, separator="\n"),
+            Settings.embed_model,
+        ],
     )
     nodes = await pipeline.arun(documents=documents)
+
+    # Re-point symbols at the chunks that survived merging before storing them
+    symbol_index = splitter.symbol_index
+    assign_symbols_to_nodes(list(symbol_index), nodes)
     await vector_store.async_add(nodes)
+    # The collection keeps the chunks of earlier runs, so keep their definitions too
+    merge_symbol_index(
+        collection_name,
+        symbol_index,
+        [doc.metadata.get("file_path", doc.metadata["file_name"]) for doc in documents],
+    )
 
     storage_context = StorageContext.from_defaults(vector_store=vector_store)
     VectorStoreIndex.from_vector_store(vector_store, storage_context=storage_context)
 
-    return len(nodes)
+    stats["chunks"] = len(nodes)
+    return stats
+
+
+def warm_collection_impl(collection_name: str, dummy_query: bool = False):
+    connections.connect(uri=MILVUS_URI, token=MILVUS_TOKEN)
+
+    if not utility.has_collection(collection_name):
+        raise ValueError(f"Collection '{collection_name}' does not exist.")
+
+    vector_store = _get_or_create_store(collection_name)
+    get_symbol_index(collection_name)
+
+    if dummy_query:
+        index = VectorStoreIndex.from_vector_store(vector_store)
+        retriever = index.as_retriever(vector_store_query_mode="hybrid", similarity_top_k=1)
+        retriever.retrieve(WARMUP_QUERY)
 
 
 def try_connection():
@@ -85,32 +152,141 @@ def search_collection_impl(
         raise ValueError(f"Collection '{collection_name}' does not exist.")
 
     vector_store = _get_or_create_store(collection_name)
-    index = VectorStoreIndex.from_vector_store(vector_store)
+    symbol_index = get_symbol_index(collection_name)
 
     mode = query_type if query_type is not None else "hybrid"
 
+    # Definition lookups are answered from the symbol index, without embedding or LLM calls
+    symbol_name = query.strip() if mode == "symbol" else parse_where_defined(query)
+    if symbol_name:
+        symbols = symbol_index.lookup(symbol_name)
+        if symbols or mode == "symbol":
+            return _symbol_results(collection_name, vector_store, symbols)
+
+    index = VectorStoreIndex.from_vector_store(vector_store)
     retriever = index.as_retriever(vector_store_query_mode=mode, similarity_top_k=10)
     retrieved_nodes = retriever.retrieve(query)
+    retrieved_nodes = _boost_symbol_matches(
+        retrieved_nodes, symbol_index.match_query(query)
+    )
+    retrieved_nodes = _collapse_adjacent_nodes(retrieved_nodes)
 
     reranker = LLMRerank(top_n=5)
     reranked_nodes = reranker.postprocess_nodes(nodes=retrieved_nodes, query_str=query)
 
     return [
-        SearchChunkResponse(
-            id=node_with_score.node.id_,
-            filePath=_get_relative_file_path(
-                collection_name, node_with_score.node.metadata.get("file_path", "")
-            ),
-            fileName=node_with_score.node.metadata.get("file_name", ""),
-            content=node_with_score.node.text,
-            lineStart=node_with_score.node.metadata.get("line_start", 0),
-            lineEnd=node_with_score.node.metadata.get("line_end", 0),
-            vectorScore=node_with_score.score,
-        )
+        _to_response(collection_name, node_with_score)
         for node_with_score in reranked_nodes
     ]
 
 
+def _to_response(
+    collection_name: str, node_with_score: NodeWithScore
+) -> SearchChunkResponse:
+    return SearchChunkResponse(
+        id=node_with_score.node.id_,
+        filePath=_get_relative_file_path(
+            collection_name, node_with_score.node.metadata.get("file_path", "")
+        ),
+        fileName=node_with_score.node.metadata.get("file_name", ""),
+        content=node_with_score.node.text,
+        lineStart=node_with_score.node.metadata.get("line_start", 0),
+        lineEnd=node_with_score.node.metadata.get("line_end", 0),
+        vectorScore=node_with_score.score,
+    )
+
+
+def _symbol_results(
+    collection_name: str, vector_store: MilvusVectorStore, symbols: List[Symbol]
+) -> List[SearchChunkResponse]:
+    node_ids = list(dict.fromkeys(symbol.node_id for symbol in symbols if symbol.node_id))
+    if not node_ids:
+        return []
+    nodes_by_id = {node.id_: node for node in vector_store.get_nodes(node_ids=node_ids)}
+    return [
+        _to_response(collection_name, NodeWithScore(node=nodes_by_id[node_id], score=1.0))
+        for node_id in node_ids
+        if node_id in nodes_by_id
+    ]
+
+
+def _boost_symbol_matches(
+    retrieved_nodes: List[NodeWithScore], symbols: List[Symbol]
+) -> List[NodeWithScore]:
+    """
+    Move retrieved chunks that define a symbol named in the query to the front of the
+    candidates. Chunks that retrieval missed are not added, to keep the rerank prompt small.
+    """
+    symbol_node_ids = {symbol.node_id for symbol in symbols if symbol.node_id}
+    if not symbol_node_ids:
+        return retrieved_nodes
+
+    boosted = [n for n in retrieved_nodes if n.node.id_ in symbol_node_ids]
+    rest = [n for n in retrieved_nodes if n.node.id_ not in symbol_node_ids]
+    return boosted + rest
+
+
+def _collapse_adjacent_nodes(nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+    """
+    Collapse chunks of the same file whose line ranges overlap or touch into a single
+    result spanning all of them, scored with the best score of its parts.
+
+    Chunks cover lines [line_start, line_end), so a chunk starting at or before the
+    line_end of another continues it. Results keep the rank of their best-ranked part.
+    A chunk that would take a result past MAX_COLLAPSED_TOKENS starts a new one instead.
+    """
+    encoding = load_encoding()
+    ranked_by_file: Dict[str, List[Tuple[int, NodeWithScore]]] = {}
+    for rank, node_with_score in enumerate(nodes):
+        metadata = node_with_score.node.metadata
+        file_path = metadata.get("file_path", "")
+        ranked_by_file.setdefault(file_path, []).append((rank, node_with_score))
+
+    collapsed: List[Tuple[int, NodeWithScore]] = []
+    for file_path, ranked_nodes in ranked_by_file.items():
+        if not file_path:
+            collapsed.extend(ranked_nodes)
+            continue
+
+        ranked_nodes.sort(key=lambda item: item[1].node.metadata.get("line_start", 0))
+        rank, current = ranked_nodes[0]
+        for next_rank, next_node in ranked_nodes[1:]:
+            current_end = current.node.metadata.get("line_end", 0)
+            next_start = next_node.node.metadata.get("line_start", 0)
+            if next_start > current_end:
+                collapsed.append((rank, current))
+                rank, current = next_rank, next_node
+                continue
+
+            # Append the lines of the next chunk that the current one does not cover yet
+            next_lines = next_node.node.text.split("\n")
+            new_lines = next_lines[current_end - next_start :]
+            text = current.node.text
+            if new_lines and next_node.node.metadata.get("line_end", 0) > current_end:
+                text = "\n".join([text, *new_lines])
+            if len(encoding.encode(text, disallowed_special=())) > MAX_COLLAPSED_TOKENS:
+                collapsed.append((rank, current))
+                rank, current = next_rank, next_node
+                continue
+
+            line_end = max(current_end, next_node.node.metadata.get("line_end", 0))
+            merged_node = current.node.model_copy(
+                update={
+                    "text": text,
+                    "metadata": {**current.node.metadata, "line_end": line_end},
+                }
+            )
+            rank = min(rank, next_rank)
+            current = NodeWithScore(
+                node=merged_node,
+                score=max(current.score or 0.0, next_node.score or 0.0),
+            )
+        collapsed.append((rank, current))
+
+    collapsed.sort(key=lambda item: item[0])
+    return [node_with_score for _, node_with_score in collapsed]
+
+
 def _get_relative_file_path(collection_name: str, file_path: str) -> str:
     # Replace whitespace and hyphen with underscore in both strings
     def normalize(s):
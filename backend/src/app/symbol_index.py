@@ -0,0 +1,362 @@
+from __future__ import annotations
+import hashlib
+import re
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+
+from src.app.shared_index import (
+    artifact_lock,
+    drop_artifacts,
+    get_current,
+    load_array,
+    load_blob,
+    preload,
+    publish_version,
+    save_array,
+    save_blob,
+)
+
+if TYPE_CHECKING:
+    # Only the splitter walks parse trees, so tree-sitter stays out of search workers
+    from tree_sitter import Node
+
+
+# tree-sitter node types that introduce a named definition, mapped to a kind
+DEFINITION_KINDS = {
+    "function_definition": "function",
+    "function_declaration": "function",
+    "function_item": "function",
+    "method_definition": "method",
+    "method_declaration": "method",
+    "constructor_declaration": "method",
+    "class_definition": "class",
+    "class_declaration": "class",
+    "class_specifier": "class",
+    "class": "class",
+    "module": "module",
+    "interface_declaration": "interface",
+    "protocol_declaration": "interface",
+    "trait_item": "interface",
+    "trait_definition": "interface",
+    "struct_item": "struct",
+    "struct_specifier": "struct",
+    "struct_declaration": "struct",
+    "enum_item": "enum",
+    "enum_declaration": "enum",
+    "enum_specifier": "enum",
+    "object_declaration": "class",
+    "object_definition": "class",
+    "type_spec": "type",
+}
+
+# Kinds whose members are reported as methods
+SCOPE_KINDS = {"class", "interface", "struct", "enum", "module"}
+
+WHERE_DEFINED_PATTERN = re.compile(
+    r"^\s*where\s+is\s+`?([A-Za-z_][\w.]*)`?\s+defined\s*\??\s*$", re.IGNORECASE
+)
+# A name in a free-text query, optionally dotted, backticked or followed by a call
+QUERY_NAME_PATTERN = re.compile(r"(`?)([A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*)(`?)(\(?)")
+
+
+@dataclass
+class Symbol:
+    name: str
+    kind: str
+    scope: str
+    file_path: str
+    line_start: int
+    line_end: int
+    node_id: str = ""
+
+    @property
+    def qualified_name(self) -> str:
+        return f"{self.scope}.{self.name}" if self.scope else self.name
+
+
+def _definition_name(node: Node) -> Optional[str]:
+    """
+    Return the name of a definition node, descending through declarators for C-like languages.
+    """
+    name_node = node.child_by_field_name("name")
+    if name_node is None:
+        declarator = node.child_by_field_name("declarator")
+        while declarator is not None and name_node is None:
+            if declarator.type in ("identifier", "field_identifier", "qualified_identifier"):
+                name_node = declarator
+            else:
+                declarator = declarator.child_by_field_name("declarator")
+    if name_node is None or name_node.text is None:
+        return None
+    return name_node.text.decode("utf-8", errors="replace")
+
+
+def extract_symbols(root_node: Node, file_path: str) -> List[Symbol]:
+    """
+    Walk a tree-sitter parse tree and collect every named definition with its enclosing scope.
+
+    Line numbers are ***1-based*** and inclusive.
+    """
+    symbols: List[Symbol] = []
+
+    def visit(node: Node, scope: List[str], in_type: bool) -> None:
+        for child in node.children:
+            kind = DEFINITION_KINDS.get(child.type)
+            name = _definition_name(child) if kind else None
+            if kind and name:
+                if kind == "function" and in_type:
+                    kind = "method"
+                symbols.append(
+                    Symbol(
+                        name=name,
+                        kind=kind,
+                        scope=".".join(scope),
+                        file_path=file_path,
+                        line_start=child.start_point[0] + 1,
+                        line_end=child.end_point[0] + 1,
+                    )
+                )
+                visit(child, scope + [name], kind in SCOPE_KINDS)
+            else:
+                visit(child, scope, in_type)
+
+    visit(root_node, [], False)
+    return symbols
+
+
+def assign_symbols_to_nodes(
+    symbols: Sequence[Symbol],
+    nodes: Sequence[BaseNode],
+    file_path: Optional[str] = None,
+) -> None:
+    """
+    Point each symbol at the chunk of its file that contains its first line, and store the
+    qualified names of the symbols defined in each chunk in its "symbols" metadata.
+
+    Nodes are grouped by their "file_path" metadata unless file_path is given, in which
+    case they are all taken to come from that file.
+    """
+    nodes_by_file: Dict[str, List[BaseNode]] = {}
+    for node in nodes:
+        node_file_path = file_path or node.metadata.get(
+            "file_path", node.metadata.get("file_name", "")
+        )
+        nodes_by_file.setdefault(node_file_path, []).append(node)
+
+    starts_by_file: Dict[str, List[int]] = {}
+    for path, file_nodes in nodes_by_file.items():
+        file_nodes.sort(key=lambda n: n.metadata.get("line_start", 0))
+        starts_by_file[path] = [n.metadata.get("line_start", 0) for n in file_nodes]
+
+    names_by_node: Dict[str, List[str]] = {}
+    for symbol in symbols:
+        file_nodes = nodes_by_file.get(symbol.file_path)
+        if not file_nodes:
+            continue
+        i = max(bisect_right(starts_by_file[symbol.file_path], symbol.line_start) - 1, 0)
+        symbol.node_id = file_nodes[i].id_
+        names_by_node.setdefault(symbol.node_id, []).append(symbol.qualified_name)
+
+    for node in nodes:
+        node.metadata["symbols"] = ",".join(names_by_node.get(node.id_, []))
+
+
+STRING_FIELDS = ("name", "kind", "scope", "file_path", "node_id")
+RECORD_DTYPE = np.dtype(
+    [(f"{f}_offset", "<i8") for f in STRING_FIELDS]
+    + [(f"{f}_length", "<i4") for f in STRING_FIELDS]
+    + [("line_start", "<i4"), ("line_end", "<i4")]
+)
+KEY_DTYPE = np.dtype([("hash", "<u8"), ("record", "<i4")])
+SYMBOLS_ARTIFACT = "symbols"
+
+
+def _key_hash(name: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+class _SymbolLookup(ABC):
+    @abstractmethod
+    def lookup(self, name: str) -> List[Symbol]:
+        """Return the definitions whose short or qualified name is exactly name."""
+
+    @abstractmethod
+    def __iter__(self) -> Iterator[Symbol]:
+        """Iterate over every definition in the index."""
+
+    def match_query(self, query: str) -> List[Symbol]:
+        """
+        Return definitions whose name appears as a code identifier in a free-text query.
+
+        Plain words are ignored, so that "run" in a sentence does not match every method
+        called run; only names that are backticked, dotted, called, snake_case or camelCase
+        are looked up.
+        """
+        matches: List[Symbol] = []
+        seen = set()
+        for opening, token, closing, call in QUERY_NAME_PATTERN.findall(query):
+            if not (
+                (opening and closing)
+                or call
+                or "." in token
+                or "_" in token
+                or any(c.isupper() for c in token[1:])
+            ):
+                continue
+            for symbol in self.lookup(token):
+                key = (symbol.file_path, symbol.line_start, symbol.qualified_name)
+                if key not in seen:
+                    seen.add(key)
+                    matches.append(symbol)
+        return matches
+
+
+class SymbolIndex(_SymbolLookup):
+    """
+    Exact-match lookup table of definitions, keyed by both short and qualified name.
+    """
+
+    def __init__(self, symbols: Optional[List[Symbol]] = None) -> None:
+        self.symbols: List[Symbol] = []
+        self._by_name: Dict[str, List[Symbol]] = {}
+        for symbol in symbols or []:
+            self.add(symbol)
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __iter__(self) -> Iterator[Symbol]:
+        return iter(self.symbols)
+
+    def add(self, symbol: Symbol) -> None:
+        self.symbols.append(symbol)
+        self._by_name.setdefault(symbol.name, []).append(symbol)
+        if symbol.scope:
+            self._by_name.setdefault(symbol.qualified_name, []).append(symbol)
+
+    def lookup(self, name: str) -> List[Symbol]:
+        return self._by_name.get(name, [])
+
+    def write(self, version_dir: str) -> None:
+        """
+        Serialize into fixed-width records, a string blob and a sorted key table, all of
+        which MappedSymbolIndex reads through memory maps.
+        """
+        blob = bytearray()
+        offsets: Dict[str, Tuple[int, int]] = {}
+
+        def intern(value: str) -> Tuple[int, int]:
+            if value not in offsets:
+                data = value.encode("utf-8")
+                offsets[value] = (len(blob), len(data))
+                blob.extend(data)
+            return offsets[value]
+
+        records = np.zeros(len(self.symbols), dtype=RECORD_DTYPE)
+        keys: List[Tuple[int, int]] = []
+        for i, symbol in enumerate(self.symbols):
+            for f in STRING_FIELDS:
+                records[i][f"{f}_offset"], records[i][f"{f}_length"] = intern(
+                    getattr(symbol, f)
+                )
+            records[i]["line_start"] = symbol.line_start
+            records[i]["line_end"] = symbol.line_end
+            keys.append((_key_hash(symbol.name), i))
+            if symbol.scope:
+                keys.append((_key_hash(symbol.qualified_name), i))
+
+        key_table = np.array(sorted(keys), dtype=KEY_DTYPE)
+        save_array(version_dir, "records", records)
+        save_array(version_dir, "keys", key_table)
+        save_blob(version_dir, "strings", bytes(blob))
+
+
+class MappedSymbolIndex(_SymbolLookup):
+    """
+    Read-only SymbolIndex backed by memory-mapped files, shared between processes.
+    """
+
+    def __init__(self, version_dir: str) -> None:
+        self._records = load_array(version_dir, "records")
+        self._keys = load_array(version_dir, "keys")
+        self._strings = load_blob(version_dir, "strings")
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[Symbol]:
+        return (self._symbol(i) for i in range(len(self._records)))
+
+    def _string(self, record: np.void, f: str) -> str:
+        offset = int(record[f"{f}_offset"])
+        length = int(record[f"{f}_length"])
+        return self._strings[offset : offset + length].decode("utf-8")
+
+    def _symbol(self, i: int) -> Symbol:
+        record = self._records[i]
+        return Symbol(
+            **{f: self._string(record, f) for f in STRING_FIELDS},
+            line_start=int(record["line_start"]),
+            line_end=int(record["line_end"]),
+        )
+
+    def lookup(self, name: str) -> List[Symbol]:
+        hashes = self._keys["hash"]
+        key_hash = np.uint64(_key_hash(name))
+        lo = int(np.searchsorted(hashes, key_hash, side="left"))
+        hi = int(np.searchsorted(hashes, key_hash, side="right"))
+        symbols = [self._symbol(int(i)) for i in self._keys["record"][lo:hi]]
+        # Guard against hash collisions
+        return [s for s in symbols if name in (s.name, s.qualified_name)]
+
+
+def get_symbol_index(collection_name: str) -> _SymbolLookup:
+    """Return the current symbol index of a collection, or an empty one if none was built."""
+    index = get_current(collection_name, SYMBOLS_ARTIFACT, MappedSymbolIndex)
+    return index if index is not None else SymbolIndex()
+
+
+def set_symbol_index(collection_name: str, index: SymbolIndex) -> None:
+    publish_version(collection_name, SYMBOLS_ARTIFACT, index.write)
+
+
+def merge_symbol_index(
+    collection_name: str, index: SymbolIndex, file_paths: Iterable[str]
+) -> SymbolIndex:
+    """
+    Publish the definitions of a new ingestion run on top of the current symbol index.
+
+    Definitions of file_paths, the files ingested by the run, are replaced by those in
+    index; definitions of every other file are kept. Concurrent merges, from other
+    workers included, are serialized so that none of them is lost.
+    """
+    replaced = set(file_paths)
+    with artifact_lock(collection_name, SYMBOLS_ARTIFACT):
+        merged = SymbolIndex(
+            [s for s in get_symbol_index(collection_name) if s.file_path not in replaced]
+        )
+        for symbol in index:
+            merged.add(symbol)
+        set_symbol_index(collection_name, merged)
+    return merged
+
+
+def drop_symbol_index(collection_name: str) -> None:
+    drop_artifacts(collection_name)
+
+
+def preload_symbol_indexes() -> int:
+    return preload(SYMBOLS_ARTIFACT, MappedSymbolIndex)
+
+
+def parse_where_defined(query: str) -> Optional[str]:
+    """Return X for queries of the form "where is X defined", else None."""
+    match = WHERE_DEFINED_PATTERN.match(query)
+    return match.group(1) if match else None
@@ -1,6 +1,10 @@
 # https://github.com/Goldziher/tree-sitter-language-pack#available-languages
+import os
+from functools import lru_cache
 from pathlib import Path
 
+import llama_index.core
+
 
 EXT_TO_LANG = {
     ".py": "python",
@@ -25,3 +29,22 @@ EXT_TO_LANG = {
 def get_language_from_filename(filename: str) -> str | None:
     ext = Path(filename).suffix.lower()
     return EXT_TO_LANG.get(ext, None)
+
+
+# Tokenizer of the text-embedding-3 models
+TOKENIZER_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def load_encoding():
+    """Load the tiktoken encoding once per process."""
+    try:
+        import tiktoken
+    except ImportError:
+        raise ImportError("Please install tiktoken to count tokens.")
+    # llama-index ships the BPE files, so no download is needed on first use
+    os.environ.setdefault(
+        "TIKTOKEN_CACHE_DIR",
+        os.path.join(os.path.dirname(llama_index.core.__file__), "_static/tiktoken_cache"),
+    )
+    return tiktoken.get_encoding(TOKENIZER_ENCODING)
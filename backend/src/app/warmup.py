@@ -0,0 +1,119 @@
+from __future__ import annotations
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Set
+
+from dotenv import load_dotenv
+from llama_index.core import Settings
+
+from src.app.store import connect_milvus, warm_collection_impl
+from src.app.utils import EXT_TO_LANG, load_encoding
+
+
+load_dotenv()
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes")
+
+
+def _env_list(name: str, default: List[str]) -> List[str]:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+@dataclass
+class WarmupConfig:
+    enabled: bool = True
+    grammars: List[str] = field(default_factory=list)
+    collections: List[str] = field(default_factory=list)
+    dummy_query: bool = False
+    retry_seconds: float = 10.0
+
+    @classmethod
+    def from_env(cls) -> WarmupConfig:
+        return cls(
+            enabled=_env_flag("WARMUP_ENABLED", True),
+            grammars=_env_list("WARMUP_GRAMMARS", sorted(set(EXT_TO_LANG.values()))),
+            collections=_env_list("WARMUP_COLLECTIONS", []),
+            dummy_query=_env_flag("WARMUP_DUMMY_QUERY", False),
+            retry_seconds=float(os.getenv("WARMUP_RETRY_SECONDS", "10")),
+        )
+
+
+@dataclass
+class WarmupReport:
+    timings: Dict[str, float] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+    required: Set[str] = field(default_factory=set)
+    attempts: int = 1
+
+    @property
+    def ready(self) -> bool:
+        """False while any phase the service cannot serve without has failed."""
+        return not self.required.intersection(self.errors)
+
+    def run(self, phase: str, fn: Callable[[], None], required: bool = False) -> None:
+        """Run one warmup phase, recording its duration and any error without aborting."""
+        if required:
+            self.required.add(phase)
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            self.errors[phase] = str(e)
+        self.timings[phase] = round(time.perf_counter() - start, 3)
+
+    def add_previous(self, previous: WarmupReport) -> None:
+        """
+        Count the earlier attempts of a retried warmup, so that each timing is the time
+        spent on its phase across all attempts, cold start included.
+        """
+        self.attempts += previous.attempts
+        for phase, seconds in previous.timings.items():
+            self.timings[phase] = round(self.timings.get(phase, 0.0) + seconds, 3)
+
+
+def _preload_grammars(languages: List[str]) -> None:
+    # Imported here so that tree-sitter is only loaded when grammars are warmed up
+    from src.app.custom_splitter import preload_languages
+
+    preload_languages(languages)
+
+
+def _open_clients() -> None:
+    embed_model = Settings.embed_model
+    embed_model._get_client()
+    Settings.llm._get_client()
+    Settings.llm._get_aclient()
+
+
+def run_warmup(config: WarmupConfig) -> WarmupReport:
+    """
+    Preload everything the first request would otherwise pay for.
+
+    Phases are independent: a failing phase is reported in WarmupReport.errors and the
+    remaining phases still run. Grammars and the tokenizer are also loaded on first use,
+    so only the clients, Milvus and the configured collections are required to be ready.
+    """
+    report = WarmupReport()
+    if not config.enabled:
+        return report
+
+    start = time.perf_counter()
+    if config.grammars:
+        report.run("grammars", lambda: _preload_grammars(config.grammars))
+    report.run("tokenizer", load_encoding)
+    report.run("clients", _open_clients, required=True)
+    report.run("milvus", connect_milvus, required=True)
+    for collection_name in config.collections:
+        report.run(
+            f"collection:{collection_name}",
+            lambda: warm_collection_impl(collection_name, config.dummy_query),
+            required=True,
+        )
+    report.timings["total"] = round(time.perf_counter() - start, 3)
+    return report